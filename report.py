@@ -1,11 +1,16 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import locale
 from pathlib import Path
+import fnmatch
 import glob
+import hashlib
 import time
 from tqdm import tqdm
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment, numbers
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import os
 import subprocess
 import platform
@@ -13,9 +18,36 @@ import sys
 from datetime import datetime
 import warnings
 
+# fastexcel - быстрое чтение Excel сразу в Arrow; без него используется pd.read_excel
+try:
+    import fastexcel
+except ImportError:
+    fastexcel = None
+
 # Подавление предупреждений
 warnings.filterwarnings('ignore')
 
+# Copy-on-Write: производные DataFrame копируются только при изменении (в pandas >= 3.0 включен всегда)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+def pbar(iterable, total=None, **kwargs):
+    """
+    Прогресс-бар tqdm с редкой перерисовкой.
+    Отключается, если вывод не в терминал (планировщик, перенаправление в файл) или задано TQDM_DISABLE=1.
+    """
+    if total is None and hasattr(iterable, "__len__"):
+        total = len(iterable)
+    disable = os.environ.get("TQDM_DISABLE") == "1" or not sys.stderr.isatty()
+    return tqdm(
+        iterable,
+        total=total,
+        disable=disable,
+        mininterval=0.5,
+        miniters=max(1, (total or 0) // 100),
+        **kwargs
+    )
+
 def open_file_in_default_app(file_path):
     """Открывает файл с помощью стандартного приложения операционной системы."""
     try:
@@ -40,6 +72,10 @@ CONFIG = {
     "SOURCE_PATTERN": "Report*.xlsx",
     "DST_FILE": "Отчёт_по_оборотам_бонусов_ПЛ_ОРТК_2024_2025.xlsx",
     "SHEET_NAME_SOURCE": "ВсеЗаправки",
+    # Суммарный размер исходных файлов, начиная с которого они читаются в отдельных процессах
+    "PROCESS_POOL_MIN_BYTES": 10 * 1024 * 1024,
+    # Папка для Parquet-кэша прочитанных файлов (None - не кэшировать)
+    "CACHE_DIR": ".cache",
     "COLS_MAPPING": {
         "Время": "date",
         "Бонусов+": "bonus_plus",
@@ -49,9 +85,36 @@ CONFIG = {
         "Станция": "azs_number",
         "Марка": "fuel_mark"
     },
+    # Типы исходных колонок в терминах fastexcel (дата разбирается отдельно при валидации)
+    "COLS_DTYPES": {
+        "Бонусов+": "float",
+        "Бонусов-": "float",
+        "Объем": "float",
+        "Основание": "string",
+        "Станция": "int",
+        "Марка": "int"
+    },
+    # Компактные типы для колонок с кодами (после переименования).
+    # Суммы остаются float64, чтобы итоги не теряли копейки
+    "COLS_COMPACT_TYPES": {
+        "azs_number": "uint32",
+        "fuel_mark": "uint8"
+    },
+    # Добавлять лист "Сырые данные" (первые 1000 строк) для проверки
+    "INCLUDE_RAW_SAMPLE": False,
+    # Формат даты в исходных файлах (None - определить автоматически по первым строкам)
+    "DATE_FORMAT": None,
+    # Форматы-кандидаты для автоопределения, проверяются по порядку
+    "DATE_FORMATS": [
+        "%d.%m.%Y %H:%M:%S",
+        "%d.%m.%Y %H:%M",
+        "%d.%m.%Y",
+        "%Y-%m-%d %H:%M:%S"
+    ],
     "NUMBER_FORMATS": {
         "financial": '#,##0.00',
-        "rate": '0.00000000'
+        "rate": '0.00000000',
+        "datetime": 'dd.mm.yyyy hh:mm'
     },
     # === НАСТРОЙКИ ФИЛЬТРАЦИИ ===
     "FILTERS": {
@@ -99,12 +162,42 @@ def setup_locale():
     print("⚠️  Не удалось установить русскую локаль. Месяцы будут на английском.")
     return False
 
-def find_source_files(pattern):
-    """Поиск исходных файлов по шаблону."""
-    source_files = glob.glob(pattern)
+# Служебные папки, которые не просматриваются при поиске исходных файлов
+# (папка кэша добавляется из CONFIG["CACHE_DIR"])
+SKIP_DIRS = {".git", ".venv", "venv", "node_modules", "__pycache__"}
+
+def find_source_files(config):
+    """Поиск исходных файлов по шаблону SOURCE_PATTERN."""
+    pattern = config["SOURCE_PATTERN"]
+    skip_dirs = SKIP_DIRS | ({Path(config["CACHE_DIR"]).name} if config["CACHE_DIR"] else set())
+    
+    # Шаблон может содержать папку (например, "data/Report*.xlsx"), в том числе с маской
+    # ("d*/Report*.xlsx") - такие папки раскрывает glob; несуществующая папка дает пустой результат
+    base_dir, name_pattern = os.path.split(pattern)
+    base_dir = base_dir or "."
+    if any(char in base_dir for char in "*?["):
+        base_dirs = sorted(path for path in glob.glob(base_dir) if os.path.isdir(path))
+    else:
+        base_dirs = [base_dir] if os.path.isdir(base_dir) else []
+    
+    source_files = []
+    for directory in base_dirs:
+        with os.scandir(directory) as entries:
+            source_files.extend(
+                os.path.join(directory, entry.name) if directory != "." else entry.name
+                for entry in entries
+                if entry.is_file() and fnmatch.fnmatch(entry.name, name_pattern)
+            )
     
+    # Рекурсивный поиск только если в папке ничего нет; служебные папки не обходим
     if not source_files:
-        source_files = glob.glob(f"**/{pattern}", recursive=True)
+        for directory in base_dirs:
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [d for d in dirs if d not in skip_dirs]
+                source_files.extend(
+                    os.path.normpath(os.path.join(root, name))
+                    for name in fnmatch.filter(files, name_pattern)
+                )
     
     if not source_files:
         print(f"❌ Файлы не найдены по шаблону: {pattern}")
@@ -120,39 +213,238 @@ def find_source_files(pattern):
     
     return source_files
 
+# Версия формата кэша: увеличивается при изменении обработки в read_excel_file
+CACHE_VERSION = 7
+
+# Соответствие типов fastexcel типам pandas для запасного чтения через pd.read_excel
+PANDAS_DTYPES = {
+    "float": "float64",
+    "int": "Int64",
+    "string": "string"
+}
+
+def get_cache_path(file_path, config):
+    """
+    Путь к Parquet-кэшу для исходного файла.
+    Ключ зависит от пути, времени изменения и размера файла, а также от набора колонок
+    и их типов, поэтому измененный файл или новая конфигурация колонок дают новый ключ.
+    Имя начинается с префикса по пути файла, чтобы прежние версии можно было найти и удалить.
+    """
+    stat = os.stat(file_path)
+    resolved_path = str(Path(file_path).resolve())
+    key = repr((
+        CACHE_VERSION,
+        resolved_path,
+        stat.st_mtime_ns,
+        stat.st_size,
+        config["SHEET_NAME_SOURCE"],
+        config["COLS_MAPPING"],
+        config["COLS_DTYPES"],
+        config["COLS_COMPACT_TYPES"]
+    ))
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return Path(config["CACHE_DIR"]) / f"{get_cache_prefix(resolved_path)}_{digest}.parquet"
+
+def get_cache_prefix(resolved_path):
+    """Префикс имени кэша, общий для всех версий одного исходного файла."""
+    return hashlib.sha1(resolved_path.encode("utf-8")).hexdigest()[:16]
+
 def load_excel_file(file_path, config):
-    """Загрузка одного Excel файла."""
+    """
+    Загрузка одного Excel файла в pyarrow.Table с кэшированием в Parquet.
+    Выполняется в дочернем процессе, поэтому ошибки не перехватываются здесь,
+    а пробрасываются в load_and_process_data.
+    """
+    if not config["CACHE_DIR"]:
+        return read_excel_file(file_path, config)
+    
+    cache_path = get_cache_path(file_path, config)
+    if cache_path.exists():
+        # Проекция по колонкам: читаются только нужные столбцы кэша
+        return normalize_table(pq.read_table(cache_path, columns=list(config["COLS_MAPPING"].values())), config)
+    
+    table = read_excel_file(file_path, config)
+    
     try:
-        # Получаем список колонок для загрузки
-        cols_to_load = list(config["COLS_MAPPING"].keys())
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Пишем во временный файл, чтобы прерванная запись не оставила битый кэш
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        pq.write_table(table, tmp_path, compression="zstd", compression_level=3)
+        os.replace(tmp_path, cache_path)
         
+        # Кэш прежних версий этого файла больше не понадобится
+        prefix = cache_path.name.split("_", 1)[0]
+        for stale_path in cache_path.parent.glob(f"{prefix}_*.parquet"):
+            if stale_path != cache_path:
+                stale_path.unlink(missing_ok=True)
+    except OSError:
+        pass
+    
+    return table
+
+def read_excel_fastexcel(file_path, config):
+    """Чтение листа через fastexcel: ячейки сразу попадают в Arrow, минуя объекты Python."""
+    cols_to_load = list(config["COLS_MAPPING"].keys())
+    
+    # Типы заданы для всех колонок, кроме даты, поэтому угадывание по выборке строк
+    # (schema_sample_rows) выполняется только для нее
+    sheet = fastexcel.read_excel(str(file_path)).load_sheet(
+        config["SHEET_NAME_SOURCE"],
+        use_columns=cols_to_load,
+        dtypes=config["COLS_DTYPES"],
+        schema_sample_rows=1000
+    )
+    table = pa.Table.from_batches([sheet.to_arrow()])
+    return table.rename_columns([config["COLS_MAPPING"][name] for name in table.column_names])
+
+def read_excel_pandas(file_path, config):
+    """Чтение листа через pandas (calamine, затем openpyxl) - если fastexcel не установлен."""
+    # Получаем список колонок для загрузки
+    cols_to_load = list(config["COLS_MAPPING"].keys())
+    dtypes = {col: PANDAS_DTYPES[dtype] for col, dtype in config["COLS_DTYPES"].items()}
+    
+    try:
+        # calamine читает и .xlsx, и .xls; типы колонок задаем сразу
         df = pd.read_excel(
             file_path,
             sheet_name=config["SHEET_NAME_SOURCE"],
             usecols=cols_to_load,
-            engine="calamine" if Path(file_path).suffix == '.xlsx' else 'openpyxl'
-        ).rename(columns=config["COLS_MAPPING"])
-        
-        tqdm.write(f"   ✓ Загружен: {Path(file_path).name} ({len(df)} строк)")
-        return df
-    except Exception as e:
-        tqdm.write(f"   ✗ Ошибка в {Path(file_path).name}: {str(e)[:100]}...")
-        return None
+            dtype=dtypes,
+            engine="calamine"
+        )
+    except Exception:
+        # Запасной вариант: openpyxl без подсказок типов (грязные данные чистятся при валидации)
+        df = pd.read_excel(
+            file_path,
+            sheet_name=config["SHEET_NAME_SOURCE"],
+            usecols=cols_to_load,
+            engine="openpyxl"
+        )
+    
+    df = df.rename(columns=config["COLS_MAPPING"])
+    
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Колонки со смешанными типами приводим к строкам, далее их разберет normalize_table.
+        # Отбор по dtype явно: select_dtypes("object") в pandas 3 захватывает и str-колонки (с предупреждением)
+        mixed_cols = [col for col in df.columns if df[col].dtype == object]
+        df[mixed_cols] = df[mixed_cols].astype("string")
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+def read_excel_file(file_path, config):
+    """
+    Чтение листа с данными из Excel файла в pyarrow.Table.
+    Основной путь - fastexcel (calamine с выдачей сразу в Arrow), запасной - pandas.
+    """
+    table = None
+    if fastexcel is not None:
+        try:
+            table = read_excel_fastexcel(file_path, config)
+        except Exception:
+            # fastexcel не справился с файлом - пробуем через pandas
+            table = None
+    
+    if table is None:
+        table = read_excel_pandas(file_path, config)
+    
+    return normalize_table(table, config)
+
+# Тип колонки "Основание" в таблицах файлов: словарь со строками, одинаковый
+# для только что прочитанных таблиц и для таблиц из Parquet-кэша
+REASON_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+def to_float_column(column):
+    """Колонка сумм в float64; нечисловые значения (грязные ячейки) становятся пустыми."""
+    if pa.types.is_floating(column.type) or pa.types.is_integer(column.type) or pa.types.is_null(column.type):
+        return pc.cast(column, pa.float64())
+    values = pd.to_numeric(column.to_pandas(), errors="coerce")
+    return pa.array(values, type=pa.float64(), from_pandas=True)
+
+def to_int_column(column, type_name):
+    """
+    Колонка кодов (АЗС, марка) в целом типе: нечисловые значения становятся пустыми.
+    Затем - компактный тип; если значения в него не помещаются, остается int64.
+    """
+    if not pa.types.is_integer(column.type):
+        values = pd.to_numeric(column.to_pandas(), errors="coerce")
+        column = pc.cast(pa.array(values, type=pa.float64(), from_pandas=True), pa.int64(), safe=False)
+    if type_name is None:
+        return column
+    try:
+        return pc.cast(column, pa.type_for_alias(type_name))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return pc.cast(column, pa.int64())
+
+def normalize_table(table, config):
+    """
+    Приведение таблицы одного файла к единой схеме, чтобы таблицы из кэша, из fastexcel
+    и из запасного чтения через pandas склеивались в pa.concat_tables без конфликта типов:
+    дата - timestamp[ns] (если ячейки уже даты) или строка, суммы - float64,
+    коды - целые (компактные типы из COLS_COMPACT_TYPES), основание - словарь.
+    """
+    date = table["date"]
+    if pa.types.is_timestamp(date.type) or pa.types.is_date(date.type):
+        date = pc.cast(date, pa.timestamp("ns"))
+    elif not pa.types.is_null(date.type):
+        date = pc.cast(date, pa.string())
+    table = table.set_column(table.schema.get_field_index("date"), "date", date)
+    
+    for source_col, dtype in config["COLS_DTYPES"].items():
+        col = config["COLS_MAPPING"][source_col]
+        if dtype == "float":
+            column = to_float_column(table[col])
+        elif dtype == "int":
+            column = to_int_column(table[col], config["COLS_COMPACT_TYPES"].get(col))
+        else:
+            continue
+        table = table.set_column(table.schema.get_field_index(col), col, column)
+    
+    reason = table["reason"]
+    if pa.types.is_dictionary(reason.type):
+        # Таблица из кэша: пробелы уже обрезаны, приводим только тип словаря
+        reason = pc.cast(reason, REASON_TYPE)
+    else:
+        # Основание: обрезка пробелов и словарное кодирование до склейки файлов,
+        # чтобы при объединении копировались коды, а не строки
+        reason = pc.dictionary_encode(pc.utf8_trim_whitespace(pc.cast(reason, pa.string())))
+    return table.set_column(table.schema.get_field_index("reason"), "reason", reason)
+
+def parse_table_dates(table, config):
+    """Разбор текстовых дат таблицы одного файла в timestamp[ns] (для склейки с файлами, где даты - значения Excel)."""
+    if pa.types.is_timestamp(table.schema.field("date").type):
+        return table
+    parsed = parse_dates(table["date"].to_pandas(), config)
+    date = pc.cast(pa.Array.from_pandas(parsed), pa.timestamp("ns"))
+    return table.set_column(table.schema.get_field_index("date"), "date", date)
+
+def get_excluded_stats(table, column):
+    """
+    Строки, бонусы и литры по каждому исключаемому значению колонки.
+    Считается только по исключаемой части таблицы (суммы уже float64 после normalize_table).
+    """
+    excluded = table.select([column, "bonus_plus", "liters"]).to_pandas()
+    return excluded.groupby(column, sort=False).agg(
+        rows=(column, "size"),
+        bonus=("bonus_plus", "sum"),
+        liters=("liters", "sum")
+    )
 
-def apply_filters(df, config):
+def apply_filters(table, config):
     """
-    Применяет фильтры для исключения марок топлива и АЗС.
-    Возвращает отфильтрованный DataFrame и статистику фильтрации.
+    Применяет фильтры для исключения марок топлива и АЗС к объединенной pyarrow.Table
+    до перехода в pandas, чтобы исключенные строки не копировались в DataFrame.
+    Возвращает отфильтрованную таблицу и статистику фильтрации.
     """
     if not config["FILTERS"]["ENABLE_FILTERING"]:
         print("ℹ️  Фильтрация отключена (ENABLE_FILTERING = False)")
-        return df, {"filtered_rows": 0, "filtered_fuel": 0, "filtered_azs": 0}
+        return table, {"filtered_rows": 0, "filtered_fuel": 0, "filtered_azs": 0}
     
     print("\n" + "="*70)
     print("🔍 ПРИМЕНЕНИЕ ФИЛЬТРОВ")
     print("="*70)
     
-    initial_count = len(df)
+    initial_count = table.num_rows
     stats = {
         "filtered_rows": 0,
         "filtered_fuel": 0,
@@ -160,37 +452,31 @@ def apply_filters(df, config):
         "initial_count": initial_count
     }
     
-    # Создаем копию для фильтрации
-    df_filtered = df.copy()
-    
     # === ФИЛЬТРАЦИЯ ПО МАРКАМ ТОПЛИВА ===
     exclude_marks = config["FILTERS"]["EXCLUDE_FUEL_MARKS"]
-    if exclude_marks and "fuel_mark" in df_filtered.columns:
+    if exclude_marks and "fuel_mark" in table.column_names:
         print("\n🚫 Фильтрация по маркам топлива:")
         
-        # Преобразуем в числовой формат
-        df_filtered["fuel_mark"] = pd.to_numeric(df_filtered["fuel_mark"], errors="coerce")
-        
-        # Подсчет строк для исключения
-        fuel_mask = df_filtered["fuel_mark"].isin(exclude_marks)
-        stats["filtered_fuel"] = fuel_mask.sum()
+        # Маска исключения; пустые значения в is_in не совпадают и остаются в данных
+        fuel_mask = pc.is_in(table["fuel_mark"], value_set=pa.array(exclude_marks))
+        excluded = table.filter(fuel_mask)
+        stats["filtered_fuel"] = excluded.num_rows
         
         # Вывод информации о исключаемых марках
         if stats["filtered_fuel"] > 0:
             print(f"   Исключаемые марки:")
+            mark_stats = get_excluded_stats(excluded, "fuel_mark")
             for mark_code in exclude_marks:
-                mark_name = config["FUEL_MARKS_DICT"].get(mark_code, f"Неизвестная ({mark_code})")
-                count = (df_filtered["fuel_mark"] == mark_code).sum()
-                if count > 0:
-                    bonus_sum = df_filtered[df_filtered["fuel_mark"] == mark_code]["bonus_plus"].sum()
-                    liters_sum = df_filtered[df_filtered["fuel_mark"] == mark_code]["liters"].sum()
+                if mark_code in mark_stats.index:
+                    mark_name = config["FUEL_MARKS_DICT"].get(mark_code, f"Неизвестная ({mark_code})")
+                    row = mark_stats.loc[mark_code]
                     print(f"      • Марка {mark_code} ({mark_name}):")
-                    print(f"        - Строк: {count:,}")
-                    print(f"        - Бонусов начислено: {bonus_sum:,.2f}")
-                    print(f"        - Литров: {liters_sum:,.2f}")
+                    print(f"        - Строк: {int(row['rows']):,}")
+                    print(f"        - Бонусов начислено: {row['bonus']:,.2f}")
+                    print(f"        - Литров: {row['liters']:,.2f}")
         
         # Применяем фильтр
-        df_filtered = df_filtered[~fuel_mask].copy()
+        table = table.filter(pc.invert(fuel_mask))
         print(f"   ✅ Отфильтровано по маркам: {stats['filtered_fuel']:,} строк")
     else:
         if not exclude_marks:
@@ -198,49 +484,85 @@ def apply_filters(df, config):
     
     # === ФИЛЬТРАЦИЯ ПО НОМЕРАМ АЗС ===
     exclude_azs = config["FILTERS"]["EXCLUDE_AZS"]
-    if exclude_azs and "azs_number" in df_filtered.columns:
+    if exclude_azs and "azs_number" in table.column_names:
         print("\n🚫 Фильтрация по номерам АЗС:")
         
-        # Преобразуем в числовой формат
-        df_filtered["azs_number"] = pd.to_numeric(df_filtered["azs_number"], errors="coerce")
-        
-        # Подсчет строк для исключения
-        azs_mask = df_filtered["azs_number"].isin(exclude_azs)
-        stats["filtered_azs"] = azs_mask.sum()
+        azs_mask = pc.is_in(table["azs_number"], value_set=pa.array(exclude_azs))
+        excluded = table.filter(azs_mask)
+        stats["filtered_azs"] = excluded.num_rows
         
         # Вывод информации о исключаемых АЗС
         if stats["filtered_azs"] > 0:
             print(f"   Исключаемые АЗС:")
+            azs_stats = get_excluded_stats(excluded, "azs_number")
             for azs_num in exclude_azs:
-                count = (df_filtered["azs_number"] == azs_num).sum()
-                if count > 0:
-                    bonus_sum = df_filtered[df_filtered["azs_number"] == azs_num]["bonus_plus"].sum()
-                    liters_sum = df_filtered[df_filtered["azs_number"] == azs_num]["liters"].sum()
+                if azs_num in azs_stats.index:
+                    row = azs_stats.loc[azs_num]
                     print(f"      • АЗС №{azs_num}:")
-                    print(f"        - Строк: {count:,}")
-                    print(f"        - Бонусов начислено: {bonus_sum:,.2f}")
-                    print(f"        - Литров: {liters_sum:,.2f}")
+                    print(f"        - Строк: {int(row['rows']):,}")
+                    print(f"        - Бонусов начислено: {row['bonus']:,.2f}")
+                    print(f"        - Литров: {row['liters']:,.2f}")
         
         # Применяем фильтр
-        df_filtered = df_filtered[~azs_mask].copy()
+        table = table.filter(pc.invert(azs_mask))
         print(f"   ✅ Отфильтровано по АЗС: {stats['filtered_azs']:,} строк")
     else:
         if not exclude_azs:
             print("\n✓ Фильтрация по АЗС не настроена (список пуст)")
     
     # === ОБЩАЯ СТАТИСТИКА ===
-    stats["filtered_rows"] = initial_count - len(df_filtered)
+    stats["filtered_rows"] = initial_count - table.num_rows
     
     print("\n" + "-"*70)
     print("📊 ИТОГИ ФИЛЬТРАЦИИ:")
     print(f"   • Исходных строк: {initial_count:,}")
     print(f"   • Отфильтровано всего: {stats['filtered_rows']:,} ({stats['filtered_rows']/initial_count*100:.2f}%)")
-    print(f"   • Осталось для анализа: {len(df_filtered):,}")
+    print(f"   • Осталось для анализа: {table.num_rows:,}")
     print("="*70)
     
-    return df_filtered, stats
+    return table, stats
+
+def detect_date_format(dates, formats, sample_size=100):
+    """
+    Подбирает формат даты по выборке значений - тот, под который подходит больше всего строк
+    (при равенстве - первый по порядку). Возвращает None, если ни один формат не подошел.
+    """
+    sample = dates.dropna().head(sample_size).astype(str)
+    best_format, best_count = None, 0
+    for date_format in formats:
+        count = pd.to_datetime(sample, format=date_format, errors="coerce").notna().sum()
+        if count > best_count:
+            best_format, best_count = date_format, count
+        if best_count == len(sample):
+            break
+    return best_format
+
+def parse_dates(dates, config):
+    """
+    Разбор дат по явному формату. Строки, не подошедшие под основной формат
+    (например, записанные без секунд), дозаполняются остальными кандидатами по порядку.
+    """
+    if config["DATE_FORMAT"] is None:
+        config["DATE_FORMAT"] = detect_date_format(dates, config["DATE_FORMATS"])
+    
+    if not config["DATE_FORMAT"]:
+        print("⚠️  Формат даты не определен, используется смешанный разбор")
+        return pd.to_datetime(dates, format="mixed", dayfirst=True, errors="coerce")
+    
+    print(f"   ✓ Формат даты: {config['DATE_FORMAT']}")
+    parsed = pd.to_datetime(dates, format=config["DATE_FORMAT"], errors="coerce")
+    
+    for date_format in config["DATE_FORMATS"]:
+        if date_format == config["DATE_FORMAT"]:
+            continue
+        unparsed = parsed.isna() & dates.notna()
+        if not unparsed.any():
+            break
+        parsed[unparsed] = pd.to_datetime(dates[unparsed], format=date_format, errors="coerce")
+    
+    return parsed
 
-def validate_and_clean_data(df):
+def validate_and_clean_data(df, config):
     """Валидация и очистка данных."""
     print("\n🔍 Проверка и очистка данных...")
     
@@ -251,8 +573,9 @@ def validate_and_clean_data(df):
         print(f"⚠️  Отсутствуют колонки: {missing_cols}")
         return None
     
-    # Преобразование даты
-    df["date"] = pd.to_datetime(df["date"], dayfirst=True, errors="coerce")
+    # Преобразование даты (если calamine уже вернул даты, разбор не нужен)
+    if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["date"] = parse_dates(df["date"], config)
     
     # Подсчет пропущенных дат
     missing_dates = df["date"].isna().sum()
@@ -260,97 +583,141 @@ def validate_and_clean_data(df):
         print(f"⚠️  Некорректных дат: {missing_dates}")
     
     # Удаление строк без даты
-    df = df.dropna(subset=["date"]).copy()
+    df = df.dropna(subset=["date"])
     
     # Преобразование числовых колонок
     numeric_cols = ["bonus_plus", "bonus_minus", "liters"]
-    for col in numeric_cols:
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
-    
-    # Преобразование основания
-    df["reason"] = df["reason"].astype(str).str.strip()
+    # Суммы уже float64 (normalize_table) - остается заполнить пропуски одной операцией
+    df[numeric_cols] = df[numeric_cols].astype("float64").fillna(0.0)
     
-    # Добавление периода
-    df["period"] = df["date"].dt.to_period("M").dt.to_timestamp()
+    # Добавление периода: усечение до месяца без промежуточного PeriodArray.
+    # Явный datetime64[ns] на входе и выходе - одинаковый результат и для Arrow-дат, и для numpy-дат
+    dates = df["date"].to_numpy(dtype="datetime64[ns]")
+    df["period"] = dates.astype("datetime64[M]").astype("datetime64[ns]")
     
     # Статистика по данным
+    # Списания в исходных файлах хранятся отрицательными, поэтому abs() по колонке не нужен
+    bp_total = df["bonus_plus"].sum()
+    bm_total = -df["bonus_minus"].sum()
     print(f"   ✓ Валидных строк: {len(df):,}")
     print(f"   ✓ Период данных: {df['date'].min().strftime('%d.%m.%Y')} - {df['date'].max().strftime('%d.%m.%Y')}")
-    print(f"   ✓ Всего начислено: {df['bonus_plus'].sum():,.2f}")
-    print(f"   ✓ Всего списано: {df['bonus_minus'].abs().sum():,.2f}")
+    print(f"   ✓ Всего начислено: {bp_total:,.2f}")
+    print(f"   ✓ Всего списано: {bm_total:,.2f}")
     
     return df
 
+def arrow_types_mapper(arrow_type):
+    """Колонки Arrow остаются ArrowDtype, словарные (основание) становятся pandas Categorical."""
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
 def load_and_process_data(config):
     """Загружает данные из нескольких XLSX файлов, объединяет и очищает их."""
-    source_files = find_source_files(config["SOURCE_PATTERN"])
+    source_files = find_source_files(config)
     if not source_files:
         return None, None
     
     print("📥 Загрузка файлов...")
-    all_data = []
+    loaded = {}
+    
+    # Файлы независимы, поэтому читаем их параллельно в отдельных процессах.
+    # Для одного или небольших файлов запуск процессов (особенно в Windows) дороже
+    # самого чтения - тогда используем потоки
+    max_workers = min(len(source_files), os.cpu_count() or 1)
+    total_size = sum(os.path.getsize(src_file) for src_file in source_files)
+    if len(source_files) > 1 and total_size >= config["PROCESS_POOL_MIN_BYTES"]:
+        executor_cls = ProcessPoolExecutor
+    else:
+        executor_cls = ThreadPoolExecutor
+    
+    with executor_cls(max_workers=max_workers) as executor:
+        futures = {executor.submit(load_excel_file, src_file, config): src_file for src_file in source_files}
+        
+        for future in pbar(as_completed(futures), total=len(futures), desc="📂 Обработка", unit="файл", ascii=False, ncols=80):
+            src_file = futures[future]
+            try:
+                table = future.result()
+            except Exception as e:
+                tqdm.write(f"   ✗ Ошибка в {Path(src_file).name}: {str(e)[:100]}...")
+                continue
+            
+            tqdm.write(f"   ✓ Загружен: {Path(src_file).name} ({table.num_rows} строк)")
+            if table.num_rows > 0:
+                loaded[src_file] = table
     
-    for src_file in tqdm(source_files, desc="📂 Обработка", unit="файл", ascii=False, ncols=80):
-        df_temp = load_excel_file(src_file, config)
-        if df_temp is not None and not df_temp.empty:
-            all_data.append(df_temp)
+    # Future хранят свои результаты, поэтому отпускаем и их: иначе пофайловые таблицы
+    # остаются в памяти до конца функции, несмотря на del и self_destruct ниже
+    del futures, future
+    
+    # Сохраняем исходный порядок файлов независимо от порядка завершения
+    all_data = [loaded[src_file] for src_file in source_files if src_file in loaded]
     
     if not all_data:
         print("❌ Не удалось загрузить данные из файлов")
         return None, None
     
-    # Объединение данных
-    df = pd.concat(all_data, ignore_index=True, sort=False)
-    print(f"📊 Всего строк объединено: {len(df):,}")
-    
-    # Применение фильтров ПЕРЕД валидацией
-    df_filtered, filter_stats = apply_filters(df, config)
+    # Даты в одних файлах - значения Excel, в других - текст: текст разбираем до склейки
+    date_is_timestamp = {
+        pa.types.is_timestamp(t.schema.field("date").type)
+        for t in all_data if not pa.types.is_null(t.schema.field("date").type)
+    }
+    if len(date_is_timestamp) > 1:
+        all_data = [parse_table_dates(t, config) for t in all_data]
+    
+    # Объединение данных: склейка Arrow-таблиц не копирует данные, копирование одно - при переходе в pandas.
+    # Схемы файлов приведены в normalize_table; permissive расширяет оставшиеся различия
+    # целых типов (коды, не поместившиеся в компактный тип в одном из файлов).
+    # Пофайловые таблицы освобождаем сразу, а self_destruct отдает память Arrow по мере конвертации колонок
+    table = pa.concat_tables(all_data, promote_options="permissive")
+    del all_data, loaded
+    print(f"📊 Всего строк объединено: {table.num_rows:,}")
+    
+    # Применение фильтров ПЕРЕД валидацией - еще на Arrow-таблице, до копирования в pandas.
+    # Кэш при этом хранит нефильтрованные данные, поэтому смена фильтров не требует перечитывания
+    table, filter_stats = apply_filters(table, config)
+    df = table.to_pandas(types_mapper=arrow_types_mapper, self_destruct=True, split_blocks=True)
+    del table
     
     # Валидация и очистка
-    df_clean = validate_and_clean_data(df_filtered)
+    df_clean = validate_and_clean_data(df, config)
     
     return df_clean, filter_stats
 
 def calculate_report(df):
-    """Выполняет агрегацию данных и расчет отчета."""
+    """
+    Выполняет агрегацию данных и расчет отчета.
+    Возвращает отчет и границы периодов (первый и последний период) для названия листа.
+    """
     print("\n📊 Расчет показателей...")
     
-    # Создаем копию для безопасности
-    df_clean = df.copy()
-    
-    # Начисления и литры (только положительные начисления)
-    positive_bonus = df_clean[df_clean["bonus_plus"] > 0].copy()
-    negative_bonus = df_clean[df_clean["bonus_minus"] < 0].copy()
-    
-    # Группировка по периоду - начисления и литры с бонусами
-    report = positive_bonus.groupby("period").agg({
-        "bonus_plus": "sum",
-        "liters": "sum"
-    }).rename(columns={
-        "bonus_plus": "Бонусов начислено",
-        "liters": "Продано литров с начислением бонусов"
-    })
-    
-    # Продано литров всего (включая без бонусов)
-    total_liters = df_clean.groupby("period")["liters"].sum()
-    report["Продано литров всего"] = total_liters
-    
-    # Списания (топливо + сопутка)
-    if not negative_bonus.empty:
-        total_minus = negative_bonus.groupby("period")["bonus_minus"].sum().abs()
-        report["Бонусов списано"] = total_minus
-    else:
-        report["Бонусов списано"] = 0
-    
-    # Заполнение отсутствующих значений
-    report = report.fillna(0)
+    bonus_plus = df["bonus_plus"].to_numpy(dtype="float64")
+    bonus_minus = df["bonus_minus"].to_numpy(dtype="float64")
+    liters = df["liters"].to_numpy(dtype="float64")
+    has_bonus = bonus_plus > 0
+    
+    # Номер месяца для каждой строки; np.unique возвращает месяцы уже отсортированными
+    months = df["period"].to_numpy().astype("datetime64[M]").view("int64")
+    month_keys, month_idx = np.unique(months, return_inverse=True)
+    n_months = len(month_keys)
+    
+    def sum_by_month(values):
+        return np.bincount(month_idx, weights=values, minlength=n_months)
+    
+    # Группировка по периоду: по одному проходу bincount на показатель.
+    # Начисления и литры - только по положительным начислениям,
+    # списания (топливо + сопутка) - по модулю отрицательных значений
+    report = pd.DataFrame({
+        "Бонусов начислено": sum_by_month(np.where(has_bonus, bonus_plus, 0.0)),
+        "Продано литров с начислением бонусов": sum_by_month(np.where(has_bonus, liters, 0.0)),
+        "Продано литров всего": sum_by_month(liters),
+        "Бонусов списано": sum_by_month(np.where(bonus_minus < 0, -bonus_minus, 0.0))
+    }, index=pd.DatetimeIndex(month_keys.astype("datetime64[M]"), name="period"))
     
     # Расчет на 1 литр
-    report["На 1 литр начислено бонусов"] = report.apply(
-        lambda row: row["Бонусов начислено"] / row["Продано литров с начислением бонусов"] 
-        if row["Продано литров с начислением бонусов"] != 0 else 0,
-        axis=1
-    )
+    bonus = report["Бонусов начислено"].to_numpy()
+    liters = report["Продано литров с начислением бонусов"].to_numpy()
+    report["На 1 литр начислено бонусов"] = np.divide(bonus, liters, out=np.zeros_like(bonus), where=liters != 0)
     
     # Форматирование периода с русскими названиями месяцев
     try:
@@ -361,27 +728,22 @@ def calculate_report(df):
     report = report.reset_index()
     report = report.rename(columns={'period': 'Период'})
     
-    return report
+    # Периоды уже отсортированы, границы берем сразу
+    if len(report):
+        period_bounds = (report["Период"].iat[0], report["Период"].iat[-1])
+    else:
+        period_bounds = (None, None)
+    
+    return report, period_bounds
 
-def get_sheet_name_from_data(df_report):
-    """Генерирует название листа."""
-    if len(df_report) == 0:
+def build_sheet_name(first_period, last_period):
+    """Генерирует название листа по первому и последнему периоду отчета."""
+    if first_period is None:
         return "Отчет"
     
-    period_col = "Период"
-    if period_col not in df_report.columns:
-        if "period" in df_report.columns:
-            period_col = "period"
-        elif "index" in df_report.columns:
-            period_col = "index"
-        else:
-            return "Отчет"
-    
-    first_period = df_report[period_col].iloc[0]
-    last_period = df_report[period_col].iloc[-1]
-    
     sheet_name = f"Отчет за {first_period} - {last_period}"
     
+    # Excel ограничивает название листа 31 символом
     if len(sheet_name) > 31:
         first_month = first_period.split()[0]
         last_month = last_period.split()[0]
@@ -390,67 +752,39 @@ def get_sheet_name_from_data(df_report):
     
     return sheet_name
 
-def format_excel_file(file_path, sheet_name, config):
-    """Применяет форматирование Excel."""
-    try:
-        wb = load_workbook(file_path)
-        
-        if sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-        else:
-            print(f"⚠️  Лист '{sheet_name}' не найден, используется активный лист")
-            ws = wb.active
-            ws.title = sheet_name[:31]
-        
-        # Автоподбор ширины колонок
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            
-            for cell in column:
-                try:
-                    cell_length = len(str(cell.value or ""))
-                    max_length = max(max_length, cell_length)
-                except:
-                    pass
-            
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Форматирование заголовков
-        for cell in ws[1]:
-            cell.alignment = Alignment(
-                wrap_text=True,
-                horizontal='center',
-                vertical='center',
-                shrink_to_fit=True
-            )
-            cell.font = cell.font.copy(bold=True)
-        
-        # Финансовый формат для числовых колонок
-        financial_cols = {
-            'B': 'Бонусов начислено', 
-            'C': 'Продано литров с начислением бонусов',
-            'D': 'Продано литров всего',
-            'E': 'Бонусов списано'
-        }
-        for col_letter, col_name in financial_cols.items():
-            if col_letter in ws.column_dimensions:
-                for row in range(2, ws.max_row + 1):
-                    cell = ws[f"{col_letter}{row}"]
-                    cell.number_format = config["NUMBER_FORMATS"]["financial"]
-        
-        # Формат для колонки F
-        if 'F' in ws.column_dimensions:
-            for row in range(2, ws.max_row + 1):
-                cell = ws[f"F{row}"]
-                cell.number_format = config["NUMBER_FORMATS"]["rate"]
-        
-        wb.save(file_path)
-        print("✅ Форматирование применено успешно")
-        
-    except Exception as e:
-        print(f"❌ Ошибка форматирования: {e}")
+def get_column_widths(df, max_width=50):
+    """Ширина колонок по самому длинному значению или заголовку (векторно, без обхода ячеек)."""
+    return [
+        min(max(df[col].astype(str).str.len().max(), len(str(col))) + 2, max_width)
+        for col in df.columns
+    ]
+
+def format_report_sheet(writer, sheet_name, df_report, config):
+    """
+    Применяет форматирование листа отчета прямо при записи (xlsxwriter):
+    автоширина и числовой формат колонок, перенос текста в заголовках.
+    """
+    wb = writer.book
+    ws = writer.sheets[sheet_name]
+    
+    financial_fmt = wb.add_format({"num_format": config["NUMBER_FORMATS"]["financial"]})
+    rate_fmt = wb.add_format({"num_format": config["NUMBER_FORMATS"]["rate"]})
+    header_fmt = wb.add_format({
+        "bold": True,
+        "text_wrap": True,
+        "align": "center",
+        "valign": "vcenter",
+        "shrink": True
+    })
+    
+    # Колонка A - период, B:E - финансовые показатели, F - на 1 литр
+    column_formats = {1: financial_fmt, 2: financial_fmt, 3: financial_fmt, 4: financial_fmt, 5: rate_fmt}
+    for col_idx, width in enumerate(get_column_widths(df_report)):
+        ws.set_column(col_idx, col_idx, width, column_formats.get(col_idx))
+    
+    # Форматирование заголовков
+    for col_idx, col_name in enumerate(df_report.columns):
+        ws.write(0, col_idx, col_name, header_fmt)
 
 def create_backup(file_path):
     """Создает резервную копию файла."""
@@ -477,7 +811,7 @@ def main():
     setup_locale()
     
     # Проверка исходных файлов
-    if not find_source_files(CONFIG["SOURCE_PATTERN"]):
+    if not find_source_files(CONFIG):
         print("❌ Программа завершена из-за отсутствия исходных файлов")
         input("Нажмите Enter для выхода...")
         sys.exit(1)
@@ -490,7 +824,7 @@ def main():
         sys.exit(1)
     
     # Расчет отчета
-    df_report = calculate_report(df_raw)
+    df_report, period_bounds = calculate_report(df_raw)
     if df_report.empty:
         print("❌ Не удалось рассчитать отчет")
         input("Нажмите Enter для выхода...")
@@ -499,41 +833,44 @@ def main():
     print(f"📊 Рассчитано периодов: {len(df_report)}")
     
     # Генерация названия листа
-    sheet_name = get_sheet_name_from_data(df_report)
+    sheet_name = build_sheet_name(*period_bounds)
     print(f"📋 Название листа: '{sheet_name}'")
     
-    # Проверка и создание резервной копии
+    # Отчет пишется во временный файл рядом с целевым: прежний отчет уходит в резервную копию
+    # только после успешной записи, поэтому при ошибке он остается на месте
     dst_path = Path(CONFIG["DST_FILE"])
-    if dst_path.exists():
-        create_backup(CONFIG["DST_FILE"])
+    tmp_path = dst_path.with_name(f"{dst_path.stem}.tmp{dst_path.suffix}")
     
     # Сохранение в Excel
     print(f"\n📝 Сохранение в '{CONFIG['DST_FILE']}'...")
     try:
         with pd.ExcelWriter(
-            CONFIG["DST_FILE"],
-            engine="openpyxl",
-            mode='w'
+            tmp_path,
+            engine="xlsxwriter",
+            mode='w',
+            datetime_format=CONFIG["NUMBER_FORMATS"]["datetime"]
         ) as writer:
             df_report.to_excel(
                 writer,
                 sheet_name=sheet_name,
                 index=False
             )
+            format_report_sheet(writer, sheet_name, df_report, CONFIG)
             
-            if len(df_raw) < 10000:
-                df_raw_sample = df_raw.head(1000).copy()
-                df_raw_sample["date"] = df_raw_sample["date"].dt.strftime("%d.%m.%Y %H:%M")
-                df_raw_sample.to_excel(
+            if CONFIG["INCLUDE_RAW_SAMPLE"] and len(df_raw) < 10000:
+                # Даты пишутся как значения Excel с форматом ячейки, без strftime по каждой строке
+                df_raw.head(1000).to_excel(
                     writer,
                     sheet_name="Сырые данные",
                     index=False
                 )
         
-        print("✅ Файл успешно сохранен")
+        # Проверка и создание резервной копии, затем замена одним переименованием
+        if dst_path.exists():
+            create_backup(dst_path)
+        os.replace(tmp_path, dst_path)
         
-        # Применение форматирования
-        format_excel_file(CONFIG["DST_FILE"], sheet_name, CONFIG)
+        print("✅ Файл успешно сохранен")
         
         # Итоговая статистика
         print("\n" + "=" * 70)
@@ -549,13 +886,21 @@ def main():
             print(f"   • По маркам топлива: {filter_stats.get('filtered_fuel', 0):,}")
             print(f"   • По номерам АЗС: {filter_stats.get('filtered_azs', 0):,}")
         
-        print(f"\n📈 Всего начислено бонусов: {df_report['Бонусов начислено'].sum():,.2f}")
-        print(f"📉 Всего списано бонусов: {df_report['Бонусов списано'].sum():,.2f}")
-        print(f"⛽ Продано литров (с бонусами): {df_report['Продано литров с начислением бонусов'].sum():,.2f}")
-        print(f"⛽ Продано литров (всего): {df_report['Продано литров всего'].sum():,.2f}")
+        # Итоги по всем периодам считаются один раз
+        totals = df_report[[
+            "Бонусов начислено",
+            "Бонусов списано",
+            "Продано литров с начислением бонусов",
+            "Продано литров всего"
+        ]].sum()
+        total_bonus = totals["Бонусов начислено"]
+        total_liters_with_bonus = totals["Продано литров с начислением бонусов"]
+        
+        print(f"\n📈 Всего начислено бонусов: {total_bonus:,.2f}")
+        print(f"📉 Всего списано бонусов: {totals['Бонусов списано']:,.2f}")
+        print(f"⛽ Продано литров (с бонусами): {total_liters_with_bonus:,.2f}")
+        print(f"⛽ Продано литров (всего): {totals['Продано литров всего']:,.2f}")
         
-        total_bonus = df_report['Бонусов начислено'].sum()
-        total_liters_with_bonus = df_report['Продано литров с начислением бонусов'].sum()
         if total_liters_with_bonus > 0:
             avg_rate = total_bonus / total_liters_with_bonus
             print(f"🧮 Средний показатель на 1 литр: {avg_rate:,.8f}")
@@ -569,6 +914,7 @@ def main():
     except Exception as e:
         print(f"❌ Ошибка при сохранении файла: {e}")
         print("Подсказка: Закройте файл Excel, если он открыт")
+        tmp_path.unlink(missing_ok=True)
     
     input("\nНажмите Enter для выхода...")
 
@@ -0,0 +1,201 @@
+import contextlib
+import copy
+import io
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import report  # noqa: E402
+
+
+def make_rows(dates, bonus_plus=10.0, liters=20.0):
+    """Строки исходного листа ВсеЗаправки с одинаковыми значениями для каждой даты."""
+    return {
+        "Время": dates,
+        "Бонусов+": [bonus_plus] * len(dates),
+        "Бонусов-": [-1.0] * len(dates),
+        "Объем": [liters] * len(dates),
+        "Основание": ["Топливо "] * len(dates),
+        "Станция": [1116] * len(dates),
+        "Марка": [14] * len(dates),
+    }
+
+
+class ReportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        self.config = copy.deepcopy(report.CONFIG)
+        self.config["SOURCE_PATTERN"] = str(self.dir / "Report*.xlsx")
+        self.config["CACHE_DIR"] = str(self.dir / ".cache")
+
+    def write_source(self, name, rows):
+        path = self.dir / name
+        pd.DataFrame(rows).to_excel(path, sheet_name=self.config["SHEET_NAME_SOURCE"], index=False)
+        return path
+
+    def load(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return report.load_and_process_data(self.config)
+
+
+class CacheTest(ReportTestCase):
+    def test_cached_and_fresh_files_concatenate(self):
+        self.write_source("Report0.xlsx", make_rows(["01.01.2025 10:00:00"] * 3))
+        df, _ = self.load()
+        self.assertEqual(len(df), 3)
+
+        # Первый файл читается из кэша, второй - заново
+        self.write_source("Report1.xlsx", make_rows(["01.02.2025 10:00:00"] * 2))
+        df, _ = self.load()
+        self.assertEqual(len(df), 5)
+        self.assertEqual(set(df["reason"]), {"Топливо"})
+
+    def test_changed_file_replaces_its_cache_entry(self):
+        path = self.write_source("Report0.xlsx", make_rows(["01.01.2025 10:00:00"]))
+        self.load()
+        old_entries = list(Path(self.config["CACHE_DIR"]).glob("*.parquet"))
+
+        self.write_source("Report0.xlsx", make_rows(["01.01.2025 10:00:00"] * 2))
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+        df, _ = self.load()
+
+        entries = list(Path(self.config["CACHE_DIR"]).glob("*.parquet"))
+        self.assertEqual(len(df), 2)
+        self.assertEqual(len(entries), 1)
+        self.assertNotEqual(entries, old_entries)
+
+    def test_compact_types_change_cache_key(self):
+        path = self.write_source("Report0.xlsx", make_rows(["01.01.2025 10:00:00"]))
+        key = report.get_cache_path(path, self.config)
+        self.config["COLS_COMPACT_TYPES"] = {"azs_number": "uint16", "fuel_mark": "uint8"}
+        self.assertNotEqual(report.get_cache_path(path, self.config), key)
+
+
+class FindSourceFilesTest(ReportTestCase):
+    def find(self, pattern):
+        self.config["SOURCE_PATTERN"] = pattern
+        with contextlib.redirect_stdout(io.StringIO()):
+            return report.find_source_files(self.config)
+
+    def test_missing_directory(self):
+        self.assertEqual(self.find(str(self.dir / "data" / "Report*.xlsx")), [])
+
+    def test_wildcard_directory(self):
+        (self.dir / "data_a").mkdir()
+        (self.dir / "data_a" / "Report_a.xlsx").touch()
+        (self.dir / "other").mkdir()
+        (self.dir / "other" / "Report_a.xlsx").touch()
+
+        found = self.find(str(self.dir / "d*" / "Report_a.xlsx"))
+
+        self.assertEqual(found, [str(self.dir / "data_a" / "Report_a.xlsx")])
+
+    def test_cache_dir_is_not_searched(self):
+        self.config["CACHE_DIR"] = str(self.dir / "kesh")
+        (self.dir / "kesh").mkdir()
+        (self.dir / "kesh" / "Report0.xlsx").touch()
+        (self.dir / "sub").mkdir()
+        (self.dir / "sub" / "Report1.xlsx").touch()
+
+        found = self.find(str(self.dir / "Report*.xlsx"))
+
+        self.assertEqual(found, [str(self.dir / "sub" / "Report1.xlsx")])
+
+
+class DirtyNumbersTest(ReportTestCase):
+    def setUp(self):
+        super().setUp()
+        # Запасной путь через pandas: грязная ячейка делает колонку строковой
+        self.fastexcel = report.fastexcel
+        report.fastexcel = None
+        self.addCleanup(setattr, report, "fastexcel", self.fastexcel)
+
+    def test_dirty_numeric_cell_counts_as_zero(self):
+        rows = make_rows(["01.01.2025 10:00:00"] * 3)
+        rows["Объем"][1] = "н/д"
+        rows["Бонусов+"][2] = "ошибка"
+        self.write_source("Report0.xlsx", rows)
+
+        df, _ = self.load()
+        with contextlib.redirect_stdout(io.StringIO()):
+            df_report, _ = report.calculate_report(df)
+
+        self.assertEqual(df["liters"].tolist(), [20.0, 0.0, 20.0])
+        self.assertEqual(df["bonus_plus"].tolist(), [10.0, 10.0, 0.0])
+        self.assertEqual(df_report["Продано литров всего"].iloc[0], 40.0)
+        self.assertEqual(df_report["Бонусов начислено"].iloc[0], 20.0)
+
+    def test_dirty_code_cell_with_exclusions(self):
+        rows = make_rows(["01.01.2025 10:00:00"] * 3)
+        rows["Марка"] = [14, "?", 18]
+        rows["Станция"] = [1116, 1118, "АЗС"]
+        self.write_source("Report0.xlsx", rows)
+        self.config["FILTERS"]["EXCLUDE_FUEL_MARKS"] = [18]
+        self.config["FILTERS"]["EXCLUDE_AZS"] = [1118]
+
+        df, stats = self.load()
+
+        self.assertEqual(stats["filtered_fuel"], 1)
+        self.assertEqual(stats["filtered_azs"], 1)
+        self.assertEqual(df["fuel_mark"].tolist(), [14])
+
+
+class MixedSchemaTest(ReportTestCase):
+    def test_text_and_excel_dates_concatenate(self):
+        self.write_source("Report0.xlsx", make_rows(["01.01.2025 10:00:00"] * 2))
+        self.write_source("Report1.xlsx", make_rows([pd.Timestamp("2025-02-01 10:00")] * 3))
+
+        df, _ = self.load()
+
+        self.assertEqual(len(df), 5)
+        self.assertEqual(
+            df["period"].value_counts().sort_index().tolist(),
+            [2, 3]
+        )
+
+    def test_fastexcel_and_pandas_tables_concatenate(self):
+        if report.fastexcel is None:
+            self.skipTest("fastexcel не установлен")
+        self.write_source("Report0.xlsx", make_rows([pd.Timestamp("2025-01-01 10:00")] * 2))
+        self.load()
+
+        # Второй файл читается запасным путем через pandas, первый берется из кэша
+        fastexcel = report.fastexcel
+        report.fastexcel = None
+        self.addCleanup(setattr, report, "fastexcel", fastexcel)
+        self.write_source("Report1.xlsx", make_rows([pd.Timestamp("2025-02-01 10:00")] * 3))
+
+        df, _ = self.load()
+
+        self.assertEqual(len(df), 5)
+
+
+class CalculateReportTest(unittest.TestCase):
+    def test_month_without_accruals_is_kept(self):
+        df = pd.DataFrame({
+            "bonus_plus": [10.0, 0.0],
+            "bonus_minus": [0.0, -5.0],
+            "liters": [20.0, 30.0],
+            "period": pd.to_datetime(["2025-01-01", "2025-02-01"]),
+        })
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            df_report, _ = report.calculate_report(df)
+
+        self.assertEqual(len(df_report), 2)
+        february = df_report.iloc[1]
+        self.assertEqual(february["Бонусов начислено"], 0.0)
+        self.assertEqual(february["Бонусов списано"], 5.0)
+        self.assertEqual(february["Продано литров всего"], 30.0)
+        self.assertEqual(february["На 1 литр начислено бонусов"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()